@@ -9,112 +9,114 @@ import numpy as np
 import sys
 import os
 import glob
+import io
+import mmap
+import re
 
 def SVD_A(A, b):
-    """Solve A*x=b using Singular Value Decomposition."""
-    U, S, V = np.linalg.svd(A)
-    # Handle singular values that are very close to zero for numerical stability
-    s_inv = np.zeros_like(S)
-    # A small tolerance to avoid division by zero or very small numbers
-    tol = np.finfo(S.dtype).eps * S.max()
-    s_inv[S > tol] = 1 / S[S > tol]
-    
-    B = np.matmul(U.T, b)
-    # Use element-wise multiplication with s_inv to handle potentially different dimensions
-    X = B[:len(S)] * s_inv.reshape(-1, 1) 
-    x = np.matmul(V.T, X)
+    """
+    Solve A*x=b in the least-squares sense using Singular Value Decomposition.
+    np.linalg.lstsq (LAPACK gelsd) never forms the (n_frames, n_frames) U matrix of a full SVD.
+    """
+    # Singular values below eps * S.max() are treated as zero for numerical stability
+    x, _, _, _ = np.linalg.lstsq(A, b, rcond=np.finfo(A.dtype).eps)
     return x
 
-def extract_xyz_data(filename):
-    """Extract data from XYZ file, skipping comment lines."""
-    frames_data = []
-    with open(filename, 'r') as file:
-        while True:
-            num_atoms_line = file.readline()
-            if not num_atoms_line: # End of file
-                break
-            
-            # Skip comment lines or empty lines
-            if num_atoms_line.startswith('#') or not num_atoms_line.strip():
-                continue
-            
-            try:
-                num_atoms = int(num_atoms_line.strip().split()[0])
-            except ValueError:
-                continue # Skip non-integer lines
-            
-            file.readline() # Read and discard the comment line (e.g., energy=...)
-            
-            atoms_info = []
-            for _ in range(num_atoms):
-                atom_line = file.readline().strip().split()
-                if not atom_line: # Handle unexpected empty lines in atom data
+# One atom line: element symbol followed by three floats (coordinates or forces)
+ATOM_DTYPE = np.dtype([('symbol', 'U16'), ('values', np.float64, (3,))])
+
+def read_xyz_frames(filename):
+    """
+    Split a multi-frame XYZ file into frames, skipping leading comment lines.
+    Every frame starts with the same atom count line, so the memory-mapped file is scanned once
+    for those lines at C speed, and the atom blocks of all frames are parsed by a single call to
+    numpy's C-implemented text reader, which converts the numbers straight into a preallocated array.
+    Returns (comments, species, values): the comment line of every frame, an (n_frames, num_atoms)
+    array of element symbols and an (n_frames, num_atoms, 3) float array of the numeric columns.
+    """
+    empty = [], np.empty((0, 0), dtype=str), np.empty((0, 0, 3))
+    with open(filename, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return empty
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # Skip comment lines or empty lines before the first frame header
+            start = 0
+            while start < len(mm):
+                end = mm.find(b'\n', start)
+                end = len(mm) if end < 0 else end
+                line = mm[start:end]
+                if line.strip() and not line.startswith(b'#'):
+                    break
+                start = end + 1
+            if start >= len(mm):
+                return empty
+
+            num_atoms = int(line.split()[0])
+            # Frame boundaries: every line holding only the atom count
+            header_re = re.compile(rb'\n[ \t]*%d[ \t]*\r?\n' % num_atoms)
+            frame_starts = [start] + [m.start() + 1 for m in header_re.finditer(mm, start)]
+            frame_ends = frame_starts[1:] + [len(mm)]
+
+            comments = []
+            atom_blocks = []
+            for frame_start, frame_end in zip(frame_starts, frame_ends):
+                comment_start = mm.find(b'\n', frame_start) + 1
+                comment_end = mm.find(b'\n', comment_start)
+                if comment_start == 0 or comment_end < 0:
+                    break
+                block = mm[comment_end + 1:frame_end].rstrip()
+                if block.count(b'\n') + 1 != num_atoms:
+                    # An incomplete frame (e.g., the last one of an interrupted run) is dropped
+                    print(f"Warning: Skipping incomplete frame {len(comments) + 1} in {filename}.")
                     continue
-                atoms_info.append(atom_line)
-            frames_data.append((num_atoms, atoms_info))
-    return frames_data # Return as a list directly
-
-def extract_forces_and_energy(frc_file, num_atoms_list):
-    """Extract forces and energy from a force file."""
-    energies = []
-    forces_list = []
-    with open(frc_file, 'r') as ff:
-        current_frame_idx = 0 # To match with num_atoms_list for frame consistency
-        while True:
-            line = ff.readline()
-            if not line:
-                break
-            line = line.strip()
-            if "E =" in line:
-                try:
-                    energy = float(line.split("E =")[-1]) * 27.211386245988  # Convert Hartree to eV
-                    energies.append(energy)
-                except ValueError:
-                    continue # Skip if energy parsing fails
-                
-                # Ensure we have a corresponding num_atoms for the current energy frame
-                if current_frame_idx >= len(num_atoms_list):
-                    # This indicates an issue where frc file has more frames than pos file
-                    print(f"Warning: More energy/force blocks in {frc_file} than atom counts in pos file. Stopping extraction for forces/energies.")
-                    break 
-                
-                num_atoms_current_frame = num_atoms_list[current_frame_idx]
-                forces = []
-                for _ in range(num_atoms_current_frame):
-                    frc_line = ff.readline().strip().split()
-                    if len(frc_line) < 4 or not frc_line[1].replace(".", "", 1).lstrip('-').isdigit():
-                        continue # Skip malformed lines or lines without numerical force data
-                    try:
-                        # Convert forces from Hartree/Bohr to eV/Angstrom
-                        force_x = float(frc_line[1]) * 51.42206747632590000
-                        force_y = float(frc_line[2]) * 51.42206747632590000
-                        force_z = float(frc_line[3]) * 51.42206747632590000
-                        forces.append((force_x, force_y, force_z))
-                    except ValueError:
-                        continue
-                forces_list.append(forces)
-                current_frame_idx += 1
-    return energies, forces_list
+                comments.append(mm[comment_start:comment_end])
+                atom_blocks.append(block)
+
+    if not atom_blocks:
+        return empty
+    n_frames = len(atom_blocks)
+    # Parse the atom lines of all frames in one go
+    atoms = np.loadtxt(io.BytesIO(b"\n".join(atom_blocks)), dtype=ATOM_DTYPE, usecols=(0, 1, 2, 3), ndmin=1)
+    species = atoms['symbol'].reshape(n_frames, num_atoms)
+    values = atoms['values'].reshape(n_frames, num_atoms, 3)
+    return comments, species, values
+
+def extract_xyz_data(filename):
+    """
+    Extract species and coordinates from XYZ file.
+    The element symbols are interned once here, so later steps work on integer ids.
+    Returns (elements, species_ids, positions): elements is the sorted array of unique element symbols,
+    species_ids is an (n_frames, num_atoms) int array indexing into elements,
+    positions is an (n_frames, num_atoms, 3) float array.
+    """
+    _, species, positions = read_xyz_frames(filename)
+    elements, species_ids = np.unique(species.ravel(), return_inverse=True)
+    return elements, species_ids.reshape(species.shape), positions
+
+def extract_forces_and_energy(frc_file):
+    """
+    Extract forces and energy from a force file.
+    Returns (energies, forces): energies is an (n_frames,) array in eV,
+    forces is an (n_frames, num_atoms, 3) array in eV/Angstrom.
+    """
+    comments, _, forces = read_xyz_frames(frc_file)
+    # The comment line looks like "i = 0, time = 0.000, E = -2441.8657675470"
+    energies = np.fromiter((float(comment.split(b"E =")[-1]) for comment in comments),
+                           dtype=np.float64, count=len(comments))
+    energies *= 27.211386245988  # Convert Hartree to eV
+
+    forces *= 51.42206747632590000 # Convert forces from Hartree/Bohr to eV/Angstrom
+    return energies, forces
 
 def extract_cell_data(cell_file):
-    """Extract lattice information from cell file."""
-    lattices = []
-    with open(cell_file, 'r') as cf:
-        cf.readline()  # Skip the header line in the cell file
-        while True:
-            line = cf.readline().strip()
-            if not line:
-                break
-            cell_line = line.split()
-            # Read 9 elements for the 3x3 lattice matrix (Ax Ay Az Bx By Bz Cx Cy Cz)
-            # Assuming format: <step_id> <time> Ax Ay Az Bx By Bz Cx Cy Cz
-            # So, the 9 values start from index 2
-            if len(cell_line) >= 11: # Check if enough columns for time + 9 lattice elements
-                lattice = " ".join(cell_line[2:11])
-                lattices.append(lattice)
-            else:
-                print(f"Warning: Skipping malformed cell line: {line} (expected at least 11 columns).")
-    return lattices
+    """
+    Extract lattice information from cell file.
+    Assumes format: <step_id> <time> Ax Ay Az Bx By Bz Cx Cy Cz after a header line,
+    so the 9 lattice elements are columns 3 to 11 (0-indexed: [2:11]).
+    Returns an (n_frames, 9) float array.
+    """
+    # np.loadtxt tokenizes and converts the whole file in C
+    return np.loadtxt(cell_file, skiprows=1, usecols=range(2, 11), ndmin=2)
 
 def extract_stress_data(stress_file):
     """
@@ -122,41 +124,25 @@ def extract_stress_data(stress_file):
     Assumes file has a header line, and then data lines with 9 stress components
     from column 3 to 11 (0-indexed: [2:11]), in 'bar' units.
     Converts 'bar' to 'eV/A^3' using the factor 6.2415e-7.
+    Returns an (n_frames, 9) float array.
     """
-    stresses_list = []
     bar_to_eV_A3 = -6.2415e-7 # 1 bar = 6.2415e-7 eV/A^3
 
-    with open(stress_file, 'r') as sf:
-        sf.readline() # Skip the first line (header)
-        for line in sf:
-            line = line.strip()
-            if not line:
-                continue
-            parts = line.split()
-            try:
-                # Read 9 components from column 3 to 11 (Python indices 2 to 10)
-                # Assuming format: [idx] [time] Sxx Sxy Sxz Syx Syy Syz Szx Szy Szz
-                # Or similar 9 components.
-                if len(parts) < 11: # Need at least 2 columns + 9 stress components = 11 columns
-                    print(f"Warning: Skipping malformed stress line: {line} (expected at least 11 columns for 9 stress values).")
-                    continue
-                
-                # Extract the 9 values and convert to float
-                stress_components_bar = [float(p) for p in parts[2:11]]
-                
-                # Convert from bar to eV/A^3
-                stress_components_eV_A3 = [s * bar_to_eV_A3 for s in stress_components_bar]
-                
-                stresses_list.append(stress_components_eV_A3)
-            except (ValueError, IndexError) as e:
-                print(f"Warning: Failed to parse stress line: {line}. Error: {e}. Skipping.")
-                continue
-    return stresses_list
-
-
-def write_xyz(output_file, pos_data, forces_list, energies, lattices, stresses_list=None):
-    with open(output_file, 'w') as of:
-        for idx, (num_atoms, atoms_info) in enumerate(pos_data):
+    # Assuming format: [idx] [time] Sxx Sxy Sxz Syx Syy Syz Szx Szy Szz
+    stresses_bar = np.loadtxt(stress_file, skiprows=1, usecols=range(2, 11), ndmin=2)
+    return stresses_bar * bar_to_eV_A3
+
+
+# symbol, x, y, z, force_x, force_y, force_z
+ATOM_LINE_FORMAT = "%-2s %20.10f %20.10f %20.10f %20.10f %20.10f %20.10f"
+# 9 components of the lattice matrix or stress tensor
+TENSOR_FORMAT = " ".join(["%.10f"] * 9)
+# 1 MiB output buffer instead of the 8 KiB default, so long trajectories need far fewer write() syscalls
+WRITE_BUFFER_SIZE = 1 << 20
+
+def write_xyz(output_file, elements, species_ids, positions, forces_list, energies, lattices, stresses_list=None):
+    with open(output_file, 'w', buffering=WRITE_BUFFER_SIZE) as of:
+        for idx, (ids, coords) in enumerate(zip(species_ids, positions)):
             # Ensure all lists have data for the current index
             # This check is crucial after data trimming in main script
             if idx >= len(energies) or idx >= len(forces_list) or idx >= len(lattices):
@@ -165,32 +151,31 @@ def write_xyz(output_file, pos_data, forces_list, energies, lattices, stresses_l
             
             energy = energies[idx]
             forces = forces_list[idx]
-            lattice = lattices[idx]
+            lattice = TENSOR_FORMAT % tuple(lattices[idx])
             
             # Prepare stress string if available
             stress_str = ""
             properties_str = "species:S:1:pos:R:3:force:R:3" # Default properties string
             
             if stresses_list is not None and idx < len(stresses_list):
-                stress_components = stresses_list[idx]
                 # Format the 9 components for the output string
-                stress_str = f" stress=\"{' '.join(f'{s:.10f}' for s in stress_components)}\""
+                stress_str = f" stress=\"{TENSOR_FORMAT % tuple(stresses_list[idx])}\""
                 properties_str += ":stress:R:9" # Add stress property for 9 components
             
-            of.write(f"{num_atoms}\n")
-            of.write(f"energy={energy:.10f} config_type=cp2k2xyz pbc=\"T T T\" Lattice=\"{lattice}\" {stress_str}Properties={properties_str}\n")
-            
-            for i, atom_info in enumerate(atoms_info):
-                if i >= len(forces): # Ensure force data exists for this atom
-                    print(f"Warning: Force data missing for atom {i} in frame {idx}. Setting to 0s.")
-                    force_x, force_y, force_z = 0.0, 0.0, 0.0
-                else:
-                    force_x, force_y, force_z = forces[i]
-
-                symbol = atom_info[0]
-                x, y, z = map(float, atom_info[1:4])
-                
-                of.write(f"{symbol:<2} {x:>20.10f} {y:>20.10f} {z:>20.10f} {force_x:>20.10f} {force_y:>20.10f} {force_z:>20.10f}\n")
+            symbols = elements[ids]
+            if len(forces) < len(symbols): # Ensure force data exists for every atom
+                print(f"Warning: Force data missing for atoms {len(forces)}-{len(symbols) - 1} in frame {idx}. Setting to 0s.")
+                forces = np.vstack([forces, np.zeros((len(symbols) - len(forces), 3))])
+
+            # Format the whole frame into one string and emit it with a single write
+            frame_lines = [
+                f"{len(symbols)}",
+                f"energy={energy:.10f} config_type=cp2k2xyz pbc=\"T T T\" Lattice=\"{lattice}\" {stress_str}Properties={properties_str}",
+            ]
+            frame_lines.extend(ATOM_LINE_FORMAT % row
+                               for row in zip(symbols.tolist(), *np.asarray(coords).T.tolist(), *np.asarray(forces).T.tolist()))
+            frame_lines.append("")
+            of.write("\n".join(frame_lines))
 
 def find_file(pattern):
     """Find a file with a given pattern. Raise error if not exactly one found."""
@@ -269,10 +254,8 @@ if __name__ == "__main__":
             sys.exit(1)
 
     # Read data from files
-    pos_data = list(extract_xyz_data(pos_file))
-    num_atoms_list = [num_atoms for num_atoms, _ in pos_data] # Collect number of atoms for each frame
-    
-    energies, forces_list = extract_forces_and_energy(frc_file, num_atoms_list)
+    elements, species_ids, positions = extract_xyz_data(pos_file)
+    energies, forces_list = extract_forces_and_energy(frc_file)
     lattices = extract_cell_data(cell_file)
     
     stresses_list = None
@@ -280,50 +263,39 @@ if __name__ == "__main__":
         stresses_list = extract_stress_data(stress_file)
 
     # --- Data Length Consistency Check ---
-    # Find the minimum length among all collected data lists
-    min_len = len(pos_data) # Start with pos_data length
-    min_len = min(min_len, len(energies))
-    min_len = min(min_len, len(forces_list))
-    min_len = min(min_len, len(lattices))
-    if stresses_list: # Only if stress data was actually loaded
-        min_len = min(min_len, len(stresses_list))
-
-    # If any list is longer than min_len, trim all lists to min_len
-    if len(pos_data) > min_len or len(energies) > min_len or \
-       len(forces_list) > min_len or len(lattices) > min_len or \
-       (stresses_list and len(stresses_list) > min_len):
+    # Find the minimum number of frames among all loaded arrays (stress data only if it was loaded)
+    frame_arrays = [a for a in (positions, energies, forces_list, lattices, stresses_list) if a is not None]
+    min_len = min(len(a) for a in frame_arrays)
+
+    # If any array is longer than min_len, trim all arrays to min_len (ndarray slices are views, nothing is copied)
+    if any(len(a) > min_len for a in frame_arrays):
         print(f"Warning: Mismatch in number of frames among input files. Trimming all data to {min_len} frames.")
-        pos_data = pos_data[:min_len]
-        energies = energies[:min_len]
-        forces_list = forces_list[:min_len]
-        lattices = lattices[:min_len]
-        if stresses_list:
+        species_ids, positions, energies, forces_list, lattices = (
+            a[:min_len] for a in (species_ids, positions, energies, forces_list, lattices))
+        if stresses_list is not None:
             stresses_list = stresses_list[:min_len]
-        num_atoms_list = num_atoms_list[:min_len] # Also trim num_atoms_list
+    del frame_arrays
 
     print(f"Processing {min_len} frames.")
 
     # --- Energy Shifting Logic ---
     if shifted == "yes":
         print('Normalizing energy....')
-        # Determine unique elements
-        all_elements = sorted(list(set(atom_info[0] for _, atoms_frame in pos_data for atom_info in atoms_frame)))
-
-        coeff_matrix = np.zeros((len(pos_data), len(all_elements)))
-        energy_matrix = np.zeros((len(pos_data), 1))
-
-        for idx, (num_atoms, atoms_info) in enumerate(pos_data):
-            for j, element in enumerate(all_elements):
-                coeff_matrix[idx][j] = sum(1 for atom in atoms_info if atom[0] == element)
-            energy_matrix[idx][0] = energies[idx]
+        # The parser already interned the element symbols (sorted) into per-atom integer ids,
+        # so count atoms of each element per frame with a single bincount over (frame, element) pairs
+        n_frames, n_elements = len(species_ids), len(elements)
+        frame_offsets = np.arange(n_frames)[:, None] * n_elements
+        coeff_matrix = np.bincount((frame_offsets + species_ids).ravel(),
+                                   minlength=n_frames * n_elements).reshape(n_frames, n_elements).astype(np.float64)
+        energy_matrix = np.asarray(energies, dtype=np.float64).reshape(-1, 1)
 
         # Check for underdetermined system and add constraints
-        if np.linalg.matrix_rank(coeff_matrix) < len(all_elements):
+        if np.linalg.matrix_rank(coeff_matrix) < len(elements):
             print("Warning! The coeff_matrix is underdetermined, adding heuristic constraints (setting adjacent element energy differences to zero).")
-            if len(all_elements) > 1:
+            if len(elements) > 1:
                 # Add N-1 constraints for N elements
-                for i in range(len(all_elements) - 1):
-                    additional_matrix = np.zeros(len(all_elements))
+                for i in range(len(elements) - 1):
+                    additional_matrix = np.zeros(len(elements))
                     additional_matrix[i], additional_matrix[i+1] = 1, -1 # E_i - E_{i+1} = 0
                     additional_energy = np.zeros(1) # We assume difference is zero
                     coeff_matrix = np.r_[coeff_matrix, [additional_matrix]]
@@ -334,7 +306,7 @@ if __name__ == "__main__":
 
         # Solve for atomic energy shifts
         atomic_shifted_energy = SVD_A(coeff_matrix, energy_matrix)
-        for i, element in enumerate(all_elements):
+        for i, element in enumerate(elements):
             print(f"{element}:{atomic_shifted_energy[i][0]:.10f} eV")
 
         # Calculate shifted energies
@@ -343,9 +315,9 @@ if __name__ == "__main__":
         print("Absolute maximum shifted energy now: %f eV." % np.max(np.abs(shifted_energies_array)))
 
         # Write shifted XYZ file
-        write_xyz("shifted.xyz", pos_data, forces_list, shifted_energies_array.tolist(), lattices, stresses_list)
+        write_xyz("shifted.xyz", elements, species_ids, positions, forces_list, shifted_energies_array.tolist(), lattices, stresses_list)
         print("Done! 'shifted.xyz' file is generated.")
 
     # Always write the original XYZ file (or the primary output if no shift)
-    write_xyz("original-stress.extxyz", pos_data, forces_list, energies, lattices, stresses_list)
+    write_xyz("original-stress.extxyz", elements, species_ids, positions, forces_list, energies, lattices, stresses_list)
     print("Done! 'original-stress.xyz' file is generated.")
@@ -5,6 +5,6 @@ import numpy as np
 data=dpdata.LabeledSystem('./',cp2k_output_name='output.log', ensemble_type="NVT", fmt="cp2kdata/md")
 
 print(data)
-# 转化为deepmd的数据格式并输出到指定位置
-data.to_deepmd_npy('./data',fmt='deepmd-npy')
+# 转化为deepmd的raw格式并输出到指定位置
+# 只写raw：03_extxyz2stress_raw.py补上virial.raw后，04_cp2k_2npy.py会从./data的raw重新生成npy，这里再写一次npy是重复的I/O
 data.to_deepmd_raw('./data',fmt='deepmd-raw')
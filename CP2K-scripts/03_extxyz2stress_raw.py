@@ -1,12 +1,31 @@
 import numpy as np
 import os
-import ase.io # 确保 ase 库已安装并导入
+import sys
 import glob
+import mmap
 import re
+from concurrent.futures import ProcessPoolExecutor
 
 # 定义一个小的数值稳定性容差，用于接近零的体积
 VOLUME_TOLERANCE = 1e-9
 
+# extxyz 头行中的 Lattice="..." 与可选的 stress="..."（同一行内，Lattice 在前）
+HEADER_RE = re.compile(rb'Lattice="([\d\.\-eE\s]+)"(?:[^\n]*?stress="([\d\.\-eE\s]+)")?')
+LATTICE_RE = re.compile(rb'Lattice=') # 只用于统计帧数上界
+
+# 写文件时使用 1 MiB 缓冲区（默认 8 KiB），减少 write() 系统调用次数
+WRITE_BUFFER_SIZE = 1 << 20
+
+def calculate_cell_volumes(cells):
+    """
+    批量计算晶胞体积。cells 为 (N,3,3) 或 (N,9) 的晶胞矩阵数组，返回 (N,) 体积数组。
+    用 3x3 行列式的解析式 a·(b×c) 对所有帧做向量化计算，避免逐帧调用 np.linalg.det。
+    """
+    C = np.asarray(cells, dtype=np.float64).reshape(-1, 3, 3)
+    return np.abs(C[:, 0, 0] * (C[:, 1, 1] * C[:, 2, 2] - C[:, 1, 2] * C[:, 2, 1])
+                  - C[:, 0, 1] * (C[:, 1, 0] * C[:, 2, 2] - C[:, 1, 2] * C[:, 2, 0])
+                  + C[:, 0, 2] * (C[:, 1, 0] * C[:, 2, 1] - C[:, 1, 1] * C[:, 2, 0]))
+
 def calculate_cell_volume(lattice_str):
     """
     根据晶胞向量字符串计算晶胞体积。
@@ -19,8 +38,7 @@ def calculate_cell_volume(lattice_str):
             print(f"DEBUG(Volume): 晶胞字符串长度不正确 ({len(coords)}): '{lattice_str}'")
             return 0.0 # 视为无效晶胞，体积为零
         
-        cell_matrix = coords.reshape(3, 3)
-        volume = np.abs(np.linalg.det(cell_matrix))
+        volume = calculate_cell_volumes(coords)[0]
         
         if volume < VOLUME_TOLERANCE:
             print(f"DEBUG(Volume): 计算出的体积非常小或为零 ({volume:.2e} Å^3)，请检查晶胞数据: '{lattice_str}'")
@@ -31,9 +49,49 @@ def calculate_cell_volume(lattice_str):
         print(f"ERROR(Volume): 计算晶胞体积出错，晶胞字符串: '{lattice_str}'。错误: {e}")
         return 0.0 # 计算错误时返回0
 
+def _process_one_extxyz(extxyz_file):
+    """
+    只扫描单个 .extxyz 文件的头行（不构建 Atoms 对象），提取每帧的应力和晶胞体积。
+    文件经 mmap 映射后用预编译的正则一次扫描出所有头行，所有帧的晶胞堆叠为 (N,3,3) 后一次性求体积。
+
+    Returns:
+        tuple: (stresses, volumes, has_stress)
+               stresses: (N,9) 数组，头行没有有效 stress 的帧为零。
+               volumes: (N,) 数组，Lattice 无效的帧体积为零。
+               has_stress: (N,) 布尔数组，标记该帧头行是否带有 stress。
+    """
+    empty = np.zeros((0, 9)), np.zeros(0), np.zeros(0, dtype=bool)
+    if os.path.getsize(extxyz_file) == 0: # 空文件无法 mmap
+        return empty
+    with open(extxyz_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        # 先数出 Lattice= 出现的次数作为帧数上界并一次性预分配数组，扫描时直接填入对应行（计数在正则的 C 实现中完成）
+        n_max = len(LATTICE_RE.findall(mm))
+        cells = np.zeros((n_max, 9))
+        stresses = np.zeros((n_max, 9))
+        has_stress = np.zeros(n_max, dtype=bool)
+        n_frames = 0
+        for m in HEADER_RE.finditer(mm):
+            lattice_str, stress_str = m.group(1), m.group(2)
+            # 分量数不是 9 的 Lattice/stress 视为无效，保持为零（体积为 0，应力为 0）
+            coords = np.fromstring(lattice_str, sep=' ')
+            if coords.shape[0] == 9:
+                cells[n_frames] = coords
+            if stress_str is not None:
+                has_stress[n_frames] = True
+                stress = np.fromstring(stress_str, sep=' ')
+                if stress.shape[0] == 9:
+                    stresses[n_frames] = stress
+            n_frames += 1
+    if n_frames == 0:
+        return empty
+
+    cells, stresses, has_stress = cells[:n_frames], stresses[:n_frames], has_stress[:n_frames]
+    return stresses, calculate_cell_volumes(cells), has_stress
+
 def extract_stress_and_volume_from_extxyz(extxyz_file_path):
     """
     读取 .extxyz 文件，提取每帧的应力张量（9分量，eV/Å^3）和晶胞体积（Å^3）。
+    只解析头行中的 Lattice 和 stress，不用 ase.io.read 为每帧构建完整的 Atoms 对象。
 
     Args:
         extxyz_file_path (str): .extxyz 文件的路径。
@@ -44,117 +102,49 @@ def extract_stress_and_volume_from_extxyz(extxyz_file_path):
                list_of_volumes: 列表，每个元素是该帧的晶胞体积。
                如果文件无法读取或解析，返回 ([], [])。
     """
-    all_stresses = []
-    all_volumes = []
-
     if not os.path.exists(extxyz_file_path):
         print(f"ERROR: .extxyz 文件未找到: {extxyz_file_path}")
         return [], []
 
     try:
-        # 使用 ase.io.read 来健壮地处理 extxyz 文件
-        ase_atoms_list = ase.io.read(extxyz_file_path, index=':')
-        print(f"DEBUG: 使用 ase.io.read 成功读取到 {len(ase_atoms_list)} 帧。")
-        
-        if not ase_atoms_list:
-            print(f"WARNING: 在 {extxyz_file_path} 中未找到任何帧。")
-            return [], []
-
-        for i, atoms in enumerate(ase_atoms_list):
-            current_stress = np.zeros(9) # 默认值，如果未找到应力则为0
-            current_volume = 0.0          # 默认值，如果未找到晶胞或计算失败则为0
-
-            # --- 提取 stress 信息 ---
-            if atoms.has('stress'):
-                # 获取 3x3 矩阵形式的应力，然后展平
-                stress_matrix = atoms.get_stress(voigt=False) # 获取 3x3 矩阵
-                
-                # 如果是 Voigt 形式 (6个分量)，则转换为 3x3 矩阵
-                if stress_matrix.shape == (6,):
-                    sxx, syy, sizz, sxy, sxz, syz = stress_matrix
-                    stress_matrix = np.array([
-                        [sxx, sxy, sxz],
-                        [sxy, syy, syz],
-                        [sxz, syz, sizz]
-                    ])
-                
-                # 假设单位已经是 eV/A3 (根据你的cp2k2xyz.py脚本输出)
-                current_stress = stress_matrix.flatten() # 展平为 9 个分量
-                print(f"DEBUG(Frame {i+1}): 成功提取应力。")
-            else:
-                print(f"WARNING(Frame {i+1}): 在 {extxyz_file_path} 中的当前帧未找到 'stress' 属性。将使用零填充。")
-
-            # --- 计算晶胞体积 ---
-            if atoms.has('cell') and atoms.get_cell().any():
-                # atoms.get_cell().array 返回 3x3 晶胞矩阵，扁平化后传递给函数
-                lattice_str = " ".join(map(str, atoms.get_cell().array.flatten()))
-                temp_volume = calculate_cell_volume(lattice_str)
-                if temp_volume is not None: # calculate_cell_volume 现在只返回 float (0.0) 或 int (0)
-                    current_volume = temp_volume
-                else: # 如果 calculate_cell_volume 内部出现严重错误导致返回 None (理论上不应该，因为我已改为返回0.0)
-                    print(f"ERROR(Frame {i+1}): 晶胞体积计算函数返回 None。将使用零体积。")
-            else:
-                print(f"WARNING(Frame {i+1}): 在 {extxyz_file_path} 中的当前帧未找到 'cell' (晶胞) 属性或其无效。将使用零体积。")
-
-            all_stresses.append(current_stress)
-            all_volumes.append(current_volume)
-            print(f"DEBUG(Frame {i+1}): stress 列表当前长度: {len(all_stresses)}, volume 列表当前长度: {len(all_volumes)}")
-
+        stresses, volumes, has_stress = _process_one_extxyz(extxyz_file_path)
     except Exception as e:
         print(f"FATAL ERROR: 处理文件 {extxyz_file_path} 时发生异常: {e}")
-        # 如果是这里捕获的异常，那么 all_stresses 和 all_volumes 可能是不完整的
         return [], []
 
-    # 最终检查列表长度是否一致
-    if len(all_stresses) != len(all_volumes):
-        print(f"ERROR: 应力数据 ({len(all_stresses)} 帧) 和体积数据 ({len(all_volumes)} 帧) 的帧数不匹配。这不应该发生，因为每个循环都添加了数据。")
-        print("请检查你的 extxyz 文件是否有异常结构或残缺帧。")
+    if len(stresses) == 0:
+        print(f"WARNING: 在 {extxyz_file_path} 中未找到任何帧。")
         return [], []
-    
-    print(f"DEBUG: 成功提取所有帧的数据。总帧数: {len(all_stresses)}")
-    return all_stresses, all_volumes
+
+    for i in np.flatnonzero(~has_stress):
+        print(f"WARNING(Frame {i+1}): 在 {extxyz_file_path} 中的当前帧未找到 'stress' 属性。将使用零填充。")
+    for i in np.flatnonzero(volumes < VOLUME_TOLERANCE):
+        print(f"WARNING(Frame {i+1}): 在 {extxyz_file_path} 中的当前帧晶胞无效或体积为零。将使用零体积。")
+    volumes[volumes < VOLUME_TOLERANCE] = 0.0
+
+    print(f"DEBUG: 成功提取所有帧的数据。总帧数: {len(stresses)}")
+    return list(stresses), volumes.tolist()
 
 def stress_datafromextxyz():
     """
-    扫描当前目录下所有*.extxyz文件，提取每帧的stress（9分量，eV/A^3）和Lattice（计算体积），返回两个列表（每帧一个元素）。
+    扫描当前目录下所有*.extxyz文件，提取每帧的stress（9分量，eV/A^3）和Lattice（计算体积）。
     适配头行同时包含Lattice和stress的extxyz格式。
-    返回: (all_stresses, all_volumes)
+    返回: (all_stresses, all_volumes)，分别为 (N,9) 和 (N,) 的数组（每行/每个元素对应一帧）。
     """
-    all_stresses = []
-    all_volumes = []
+    all_stresses = [np.zeros((0, 9))]
+    all_volumes = [np.zeros(0)]
     extxyz_files = glob.glob("*.extxyz")
-    for extxyz_file in extxyz_files:
-        with open(extxyz_file, 'r') as f:
-            lines = f.readlines()
-        for line in lines:
-            if 'Lattice=' in line and 'stress=' in line:
-                # 提取Lattice
-                lattice_match = re.search(r'Lattice="([\d\.\-eE\s]+)"', line)
-                if lattice_match:
-                    lattice_str = lattice_match.group(1)
-                    coords = list(map(float, lattice_str.split()))
-                    if len(coords) == 9:
-                        cell_matrix = np.array(coords).reshape(3, 3)
-                        volume = abs(np.linalg.det(cell_matrix))
-                    else:
-                        volume = 0.0
-                else:
-                    volume = 0.0
-                # 提取stress
-                stress_match = re.search(r'stress="([\d\.\-eE\s]+)"', line)
-                if stress_match:
-                    stress_str = stress_match.group(1)
-                    stress = np.array(list(map(float, stress_str.split())))
-                    if stress.shape[0] == 9:
-                        all_stresses.append(stress)
-                        all_volumes.append(volume)
-                    else:
-                        all_stresses.append(np.zeros(9))
-                        all_volumes.append(volume)
-                else:
-                    all_stresses.append(np.zeros(9))
-                    all_volumes.append(volume)
-    return all_stresses, all_volumes
+    if len(extxyz_files) > 1:
+        # 各文件相互独立，多进程并行扫描（map 保持文件顺序）
+        with ProcessPoolExecutor() as executor:
+            results = list(executor.map(_process_one_extxyz, extxyz_files))
+    else:
+        results = [_process_one_extxyz(extxyz_file) for extxyz_file in extxyz_files]
+    for stresses, volumes, has_stress in results:
+        # 只保留头行同时带 Lattice 和 stress 的帧
+        all_stresses.append(stresses[has_stress])
+        all_volumes.append(volumes[has_stress])
+    return np.concatenate(all_stresses), np.concatenate(all_volumes)
 
 def calculate_virial_from_stress(stress_tensor, volume):
     """
@@ -192,36 +182,62 @@ def write_virial_raw(output_file_path, all_virials):
     except Exception as e:
         print(f"ERROR: 写入维里数据到 {output_file_path} 时出错: {e}")
 
+def calculate_virials(stresses, volumes):
+    """
+    根据stresses和volumes批量计算维里：所有帧堆叠为 (N, 9) 应力数组和 (N,) 体积数组，一次广播乘法算出 (N, 9) 维里数组。
+    """
+    conversion_factor = 1e4 / (6.24 * 1602.17)
+    stress_array = np.asarray(stresses, dtype=np.float64).reshape(len(stresses), 9)
+    volume_array = np.asarray(volumes, dtype=np.float64)
+    return stress_array * volume_array[:, None] * conversion_factor
+
 def write_virial_raw_from_stress_data(stresses, volumes, output_file="virial.raw",outdir="./data"):
     """
     根据stresses和volumes，按公式输出九列数据到virial.raw，首行为空。
+    全部维里由 np.savetxt 一次写出。
     """
-    if not stresses or not volumes or len(stresses) != len(volumes):
+    if len(stresses) == 0 or len(volumes) == 0 or len(stresses) != len(volumes):
         print("输入数据为空或长度不一致，无法写入virial.raw")
         return
-    conversion_factor = 1e4 / (6.24 * 1602.17)
     os.makedirs(outdir, exist_ok=True)
     output_path = os.path.join(outdir, output_file)
-    with open(output_path, 'w') as f:
-        for stress, volume in zip(stresses, volumes):
-            virial = stress * volume * conversion_factor
-            f.write(" ".join(f"{v:20.10f}" for v in virial) + "\n")
+    with open(output_path, 'w', buffering=WRITE_BUFFER_SIZE) as f:
+        np.savetxt(f, calculate_virials(stresses, volumes), fmt='%20.10f')
     print(f"已写入 {len(stresses)} 行到 {output_file}")
 
-def write_stress_and_volume_data(stresses, volumes, outdir="."):
+def write_virial_npy(stresses, volumes, output_file="virial.npy", outdir="./data"):
+    """
+    与 write_virial_raw_from_stress_data 相同的 (N, 9) 维里数组，以二进制 .npy 格式写出（无浮点数到文本的转换，文件更小）。
+    """
+    if len(stresses) == 0 or len(volumes) == 0 or len(stresses) != len(volumes):
+        print(f"输入数据为空或长度不一致，无法写入{output_file}")
+        return
+    os.makedirs(outdir, exist_ok=True)
+    output_path = os.path.join(outdir, output_file)
+    np.save(output_path, calculate_virials(stresses, volumes))
+    print(f"已写入 {len(stresses)} 帧到 {output_file}")
+
+def write_stress_and_volume_data(stresses, volumes, outdir=".", binary=False):
     """
     将stress和volume分别输出到data/stress.txt和data/volume.txt。
     每行对应一帧，stress为九列，volume为一列。
+    binary=True 时改为输出二进制的 stress.npy 和 volume.npy。
     """
     os.makedirs(outdir, exist_ok=True)
-    stress_path = os.path.join(outdir, "stress.txt")
-    volume_path = os.path.join(outdir, "volume.txt")
-    with open(stress_path, 'w') as f_stress:
-        for stress in stresses:
-            f_stress.write(" ".join(f"{v:20.10f}" for v in stress) + "\n")
-    with open(volume_path, 'w') as f_volume:
-        for v in volumes:
-            f_volume.write(f"{v:20.10f}\n")
+    stress_array = np.asarray(stresses, dtype=np.float64).reshape(len(stresses), 9)
+    volume_array = np.asarray(volumes, dtype=np.float64)
+    if binary:
+        stress_path = os.path.join(outdir, "stress.npy")
+        volume_path = os.path.join(outdir, "volume.npy")
+        np.save(stress_path, stress_array)
+        np.save(volume_path, volume_array)
+    else:
+        stress_path = os.path.join(outdir, "stress.txt")
+        volume_path = os.path.join(outdir, "volume.txt")
+        with open(stress_path, 'w', buffering=WRITE_BUFFER_SIZE) as f_stress:
+            np.savetxt(f_stress, stress_array, fmt='%20.10f')
+        with open(volume_path, 'w', buffering=WRITE_BUFFER_SIZE) as f_volume:
+            np.savetxt(f_volume, volume_array, fmt='%20.10f')
     print(f"已写入 {len(stresses)} 行到 {stress_path} 和 {volume_path}")
 
 # --- 主执行部分 (保持不变，用于测试) ---
@@ -275,9 +291,14 @@ H    0.1 1.0 0.0
         print("未能提取应力和体积数据。")
 
     # 新增批量处理extxyz文件的功能
+    # python 03_extxyz2stress_raw.py --npy：stress/volume 以二进制 .npy 输出，并额外输出 data/virial.npy
+    # virial.raw 总是输出，04_cp2k_2npy.py 通过 dpdata 的 deepmd/raw 格式读取它
+    binary = "--npy" in sys.argv[1:]
     stresses, volumes = stress_datafromextxyz()
     write_virial_raw_from_stress_data(stresses, volumes)
-    write_stress_and_volume_data(stresses, volumes)
+    if binary:
+        write_virial_npy(stresses, volumes)
+    write_stress_and_volume_data(stresses, volumes, binary=binary)
 
     # 清理测试文件 (根据需要启用或禁用)
     # os.remove(test_extxyz_file)
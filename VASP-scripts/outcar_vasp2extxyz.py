@@ -1,11 +1,12 @@
-from ase.io import read, write
+from ase.io import iread, read, write
 from ase.calculators.vasp import Vasp
 
 #支持多帧结构
-# 读取 OUTCAR 中的所有离子步（返回 Atoms 对象列表）
-mace_trainsets = read('OUTCAR', index=':', format='vasp-out')
-# 保存为多帧 extxyz 文件（支持轨迹）
-write('mace_multisets.extxyz', mace_trainsets, format='extxyz')
+# 逐帧读取 OUTCAR 中的离子步（iread 为生成器，内存中每次只有一个 Atoms 对象）
+# 并依次写入同一个多帧 extxyz 文件（支持轨迹）
+with open('mace_multisets.extxyz', 'w') as f:
+    for atoms in iread('OUTCAR', index=':', format='vasp-out'):
+        write(f, atoms, format='extxyz')
 
 
 
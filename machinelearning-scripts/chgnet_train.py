@@ -1,59 +1,187 @@
+import os
+import random
+from multiprocessing import Pool
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, SubsetRandomSampler
 from chgnet.utils import read_json
 from pymatgen.core import Structure
-from chgnet.data.dataset import StructureData, get_train_val_test_loader
+from chgnet.data.dataset import GraphData, collate_graphs
+from chgnet.graph import CrystalGraph, CrystalGraphConverter
 from chgnet.model import CHGNet
 from chgnet.trainer import Trainer
 
 
-dataset_dict = read_json("./chgnet_dataset.json")
-structures = [Structure.from_dict(struct) for struct in dataset_dict["structure"]]
-energies = dataset_dict["energy_per_atom"]
-forces = dataset_dict["force"]
-stresses = dataset_dict.get("stress") or None
-magmoms = dataset_dict.get("magmom") or None
-
-
-dataset = StructureData(
-    structures=structures,
-    energies=energies,
-    forces=forces,
-    stresses=stresses,  # can be None
-    magmoms=magmoms,  # can be None
-)
-train_loader, val_loader, test_loader = get_train_val_test_loader(
-    dataset, batch_size=8, train_ratio=0.9, val_ratio=0.05
-)
-
-
-# Load pretrained CHGNet
-chgnet = CHGNet.load()
-
-
-# Optionally fix the weights of some layers
-for layer in [
-    chgnet.atom_embedding,
-    chgnet.bond_embedding,
-    chgnet.angle_embedding,
-    chgnet.bond_basis_expansion,
-    chgnet.angle_basis_expansion,
-    chgnet.atom_conv_layers[:-1],
-    chgnet.bond_conv_layers,
-    chgnet.angle_layers,
-]:
-    for param in layer.parameters():
-        param.requires_grad = False
-
-#         Define Trainer
-trainer = Trainer(
-    model=chgnet,
-    targets="efs",
-    optimizer="Adam",
-    scheduler="CosLR",
-    criterion="MSE",
-    epochs=20,
-    learning_rate=1e-2,
-    use_device="cuda",
-    print_freq=6,
-)
-trainer.train(train_loader, val_loader, test_loader)
+# Crystal graphs are built once with the pretrained model's graph converter (same cutoffs/algorithm)
+# and cached on disk, so training (and later runs) only torch.load them instead of rebuilding graphs in Python.
+# Delete graph_dir after changing chgnet_dataset.json or the model, otherwise the old graphs are reused.
+graph_dir = "./chgnet_graphs"
+converter = None  # set in each Pool worker by init_converter
+
+# The cached .pt files are pickled CrystalGraph objects; torch>=2.6 loads with weights_only=True by default,
+# which refuses unknown classes (GraphData would then skip every sample). Allow the class at import time,
+# so it also holds in spawned DataLoader workers.
+torch.serialization.add_safe_globals([CrystalGraph])
+
+
+def init_converter(converter_dict):
+    """Pool initializer: build the worker's CrystalGraphConverter from the model's converter settings."""
+    global converter
+    converter = CrystalGraphConverter.from_dict(converter_dict)
+
+
+def make_graph(args):
+    """Convert one structure dict to a CrystalGraph saved as <graph_dir>/<idx>.pt; return idx, or None if it fails."""
+    idx, struct = args
+    graph_file = os.path.join(graph_dir, f"{idx}.pt")
+    if not os.path.exists(graph_file):
+        try:
+            graph = converter(Structure.from_dict(struct), graph_id=str(idx), mp_id="dataset")
+        except Exception as e:  # e.g. structures with isolated atoms
+            print(f"Skipping structure {idx}: {e}")
+            return None
+        torch.save(graph, graph_file)
+    return idx
+
+
+def _pin_memory(self):
+    """Return a copy of the graph with every tensor in pinned (page-locked) host memory."""
+    return CrystalGraph.from_dict({k: v.pin_memory() if torch.is_tensor(v) else v for k, v in self.to_dict().items()})
+
+
+_crystal_graph_to = CrystalGraph.to
+
+
+def _to(self, device="cpu"):
+    """
+    Move the graph to a device. Copies to a CUDA device (the Trainer's host-to-device batch transfers)
+    run asynchronously from pinned memory; any other target keeps chgnet's blocking copy, so e.g.
+    moving a graph back to the CPU never hands out tensors before the copy has finished.
+    """
+    if torch.device(device).type != "cuda":
+        return _crystal_graph_to(self, device)
+    return CrystalGraph.from_dict({k: v.to(device, non_blocking=True) if torch.is_tensor(v) else v
+                                   for k, v in self.to_dict().items()})
+
+
+def _move_to(obj, device):
+    """Trainer.move_to with non_blocking host-to-device copies."""
+    if torch.is_tensor(obj):
+        return obj.to(device, non_blocking=True)
+    return [None if tensor is None else tensor.to(device, non_blocking=True) for tensor in obj]
+
+
+# The DataLoader pin-memory thread only pins types it knows (or that define pin_memory()),
+# so teach CrystalGraph to pin itself and let the Trainer copy batches to the GPU without blocking
+CrystalGraph.pin_memory = _pin_memory
+CrystalGraph.to = _to
+Trainer.move_to = staticmethod(_move_to)
+
+
+def get_train_val_test_loader(dataset, *, batch_size=8, train_ratio=0.8, val_ratio=0.1, num_workers=0):
+    """
+    Randomly partition a dataset into train, val, test loaders (same split as chgnet's helper),
+    with worker prefetching, persistent workers and pinned memory so batch loading overlaps training.
+    """
+    indices = list(range(len(dataset)))
+    random.shuffle(indices)
+    train_size = int(train_ratio * len(dataset))
+    val_size = int(val_ratio * len(dataset))
+    splits = indices[:train_size], indices[train_size:train_size + val_size], indices[train_size + val_size:]
+    return tuple(
+        DataLoader(
+            dataset,
+            batch_size=batch_size,
+            collate_fn=collate_graphs,
+            sampler=SubsetRandomSampler(split),
+            num_workers=num_workers,
+            pin_memory=torch.cuda.is_available(),
+            persistent_workers=num_workers > 0,
+            prefetch_factor=4 if num_workers > 0 else None,
+        )
+        for split in splits
+    )
+
+
+if __name__ == "__main__":
+    dataset_dict = read_json("./chgnet_dataset.json")
+    energies = dataset_dict["energy_per_atom"]
+    forces = dataset_dict["force"]
+    stresses = dataset_dict.get("stress") or None
+    magmoms = dataset_dict.get("magmom") or None
+
+    # Load pretrained CHGNet
+    # (not wrapped in torch.compile: forces/stresses come from torch.autograd.grad(create_graph=True),
+    #  and compiled modules do not support the double backward that training on "efs" needs;
+    #  kept in fp32 without bf16 autocast/TF32: Cartesian positions are a frac_coord @ lattice matmul,
+    #  and reduced-precision matmuls would perturb every interatomic distance and the derived forces)
+    chgnet = CHGNet.load()
+
+    os.makedirs(graph_dir, exist_ok=True)
+    with Pool(initializer=init_converter, initargs=(chgnet.graph_converter.as_dict(),)) as pool:
+        converted = [idx for idx in pool.imap_unordered(
+            make_graph, enumerate(dataset_dict["structure"]), chunksize=16) if idx is not None]
+
+    # Pack the JSON label lists once into contiguous float32 arrays (per-atom forces concatenated, with offsets),
+    # so GraphData's per-sample torch.tensor() copies an array slice instead of walking nested Python lists,
+    # and DataLoader workers share a few large arrays instead of millions of Python floats
+    converted.sort()
+    energies = np.asarray(energies, dtype=np.float32)
+    force_offsets = np.cumsum([0] + [len(forces[idx]) for idx in converted])
+    forces = np.concatenate([np.asarray(forces[idx], dtype=np.float32) for idx in converted])
+    if stresses is not None:
+        stresses = np.asarray(stresses, dtype=np.float32)
+    del dataset_dict  # only the packed arrays are needed from here on
+
+    # Labels in the layout GraphData expects: {mp_id: {graph_id: {key: value}}}
+    labels = {"dataset": {}}
+    for k, idx in enumerate(converted):
+        label = {"energy_per_atom": energies[idx], "force": forces[force_offsets[k]:force_offsets[k + 1]]}
+        if stresses is not None:
+            label["stress"] = stresses[idx]
+        if magmoms is not None:
+            label["magmom"] = None if magmoms[idx] is None else np.asarray(magmoms[idx], dtype=np.float32)
+        labels["dataset"][str(idx)] = label
+
+    dataset = GraphData(graph_path=graph_dir, labels=labels, targets="efs")
+    train_loader, val_loader, test_loader = get_train_val_test_loader(
+        dataset, batch_size=8, train_ratio=0.9, val_ratio=0.05, num_workers=max(1, (os.cpu_count() or 2) // 2)
+    )
+
+
+    # Optionally fix the weights of some layers
+    # (only their weights: they must still run with autograd, because forces/stresses are derivatives
+    #  of the energy w.r.t. the positions that flow through these layers, so no torch.no_grad() here,
+    #  and no torch.jit.freeze either, which only produces inference-mode modules)
+    for layer in [
+        chgnet.atom_embedding,
+        chgnet.bond_embedding,
+        chgnet.angle_embedding,
+        chgnet.bond_basis_expansion,
+        chgnet.angle_basis_expansion,
+        chgnet.atom_conv_layers[:-1],
+        chgnet.bond_conv_layers,
+        chgnet.angle_layers,
+    ]:
+        layer.requires_grad_(False)
 
+    #         Define Trainer
+    trainer = Trainer(
+        model=chgnet,
+        targets="efs",
+        optimizer="Adam",
+        scheduler="CosLR",
+        criterion="MSE",
+        epochs=20,
+        learning_rate=1e-2,
+        use_device="cuda",
+        print_freq=6,
+    )
+    # Fused Adam updates all parameters in one CUDA kernel per step instead of a launch per tensor.
+    # Trainer builds the optimizer from its name, so switch the per-group "fused" option on afterwards
+    # (the parameters are on the GPU by the first step; zero_grad() already sets grads to None)
+    if torch.cuda.is_available():
+        for group in trainer.optimizer.param_groups:
+            group["fused"] = True
+    trainer.train(train_loader, val_loader, test_loader)
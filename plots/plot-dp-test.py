@@ -1,6 +1,63 @@
+import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
 import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+# Simplify long paths aggressively and let Agg render them in chunks (cheaper savefig at dpi=300)
+matplotlib.rcParams.update({"path.simplify": True, "path.simplify_threshold": 1.0, "agg.path.chunksize": 10_000})
+
+# Above this many points, force/virial components are drawn as one log-scaled hexbin density
+# instead of per-component scatters (hundreds of thousands of markers are slow and just overplot)
+HEXBIN_MIN_POINTS = 100_000
+
+# Energies need float64: total energies are ~1e4-1e5 eV, where float32 steps are several meV and the
+# points of a sub-eV parity plot would snap to a grid. Forces and virials are small numbers, float32 suffices
+# and halves the arrays handed to scatter.
+LOAD_DTYPES = {'e': np.float64, 'f': np.float32, 'v': np.float32}
+
+def read_dp_test_cache(filepath, dtype=np.float64):
+    """
+    Returns the <filepath>.npy cache written by load_dp_test_file, memory-mapped, if it is not older than
+    the text file and has the requested dtype; otherwise None.
+    Called in the main process, so the memory map is what matplotlib reads from.
+    """
+    npy_path = filepath + ".npy"
+    if not os.path.exists(npy_path) or os.path.getmtime(npy_path) < os.path.getmtime(filepath):
+        return None
+    try:
+        data_raw = np.load(npy_path, mmap_mode="r")
+    except (OSError, ValueError): # truncated/corrupt cache: parse the text file again
+        return None
+    return data_raw if data_raw.dtype == dtype else None
+
+def load_dp_test_file(filepath, dtype=np.float64):
+    """
+    Loads one dp test output file, skipping the first row (header), with one row per column (unpack=True),
+    and caches the parsed array next to the file as <filepath>.npy for read_dp_test_cache.
+    """
+    npy_path = filepath + ".npy"
+    data_raw = np.loadtxt(filepath, skiprows=1, unpack=True, dtype=dtype)
+    try:
+        np.save(npy_path, data_raw)
+    except OSError as e: # e.g. read-only directory: just plot without caching
+        print(f"Warning: could not write cache {npy_path}: {e}")
+    return data_raw
+
+def plot_components(ax, dft_vals, pred_vals, component_names, min_val, max_val, alpha):
+    """
+    Plots DFT vs predicted values of several tensor components on one axis.
+    dft_vals / pred_vals have one row per component; small sets get one coloured scatter per component,
+    large sets a single hexbin density over all components.
+    """
+    if dft_vals.size >= HEXBIN_MIN_POINTS:
+        hb = ax.hexbin(dft_vals.ravel(), pred_vals.ravel(), gridsize=80, mincnt=1, bins='log',
+                       extent=(min_val, max_val, min_val, max_val), cmap='viridis', rasterized=True)
+        ax.figure.colorbar(hb, ax=ax, label='Count')
+        return
+    for j, name in enumerate(component_names):
+        ax.scatter(dft_vals[j], pred_vals[j], s=5, alpha=alpha, label=name, rasterized=True)
 
 def plot_dp_test_results_scatter(output_files_config, save_path="dp_test.png"):
     """
@@ -15,124 +72,120 @@ def plot_dp_test_results_scatter(output_files_config, save_path="dp_test.png"):
                   {'filepath': 'test.v.out', 'title': 'Virial', 'ylabel': 'Virial (eV)', 'type': 'v'}
         save_path (str): The path to save the combined plot.
     """
-    num_plots = len(output_files_config)
-    # Arrange plots in 2 rows, calculate columns needed
-    num_rows = 2
-    num_cols = (num_plots + num_rows - 1) // num_rows # Ceiling division to get required columns
-
-    # Adjust figure size for better readability, especially with multiple plots
-    fig, axes = plt.subplots(num_rows, num_cols, figsize=(6 * num_cols, 5 * num_rows))
+    # Files with a fresh .npy cache are memory-mapped here; only the others are parsed, in parallel
+    # worker processes (no pool at all when everything is cached). The drawing below stays in this process.
+    # The with block shuts the workers down even if drawing fails outside the per-panel try.
+    existing_files = {config['filepath']: LOAD_DTYPES.get(config['type'], np.float64)
+                      for config in output_files_config if os.path.exists(config['filepath'])}
+    cached = {filepath: read_dp_test_cache(filepath, dtype) for filepath, dtype in existing_files.items()}
+    to_parse = {filepath: dtype for filepath, dtype in existing_files.items() if cached[filepath] is None}
+    with ProcessPoolExecutor(max_workers=len(to_parse)) if to_parse else nullcontext() as executor:
+        futures = {filepath: executor.submit(load_dp_test_file, filepath, dtype)
+                   for filepath, dtype in to_parse.items()}
+
+        num_plots = len(output_files_config)
+        # Arrange plots in 2 rows, calculate columns needed
+        num_rows = 2
+        num_cols = (num_plots + num_rows - 1) // num_rows # Ceiling division to get required columns
+
+        # Adjust figure size for better readability, especially with multiple plots
+        fig, axes = plt.subplots(num_rows, num_cols, figsize=(6 * num_cols, 5 * num_rows))
     
-    # Flatten axes array for easy iteration if it's 2D
-    axes = axes.flatten()
-
-    # Define component names for force (f) and virial (v) legends
-    component_names_f = ["fx", "fy", "fz"]
-    component_names_v = ["xx", "xy", "xz", "yx", "yy", "yz", "zx", "zy", "zz"]
-
-    for i, config in enumerate(output_files_config):
-        filepath = config['filepath']
-        title = config['title']
-        ylabel_full = config['ylabel'] # Full Y-axis label, e.g., "Energy (eV)"
-        plot_type = config['type']
-
-        # Extract base name from full Y-axis label for X/Y axis titles
-        ylabel_base = ylabel_full.split('(')[0].strip()
-
-        ax = axes[i] # Get the current subplot axis
-
-        if not os.path.exists(filepath):
-            print(f"Warning: File not found: {filepath}. Skipping this plot.")
-            ax.set_title(f"{title} (File not found)", color='red')
-            # Clear axis if skipped, to prevent empty plot with default ticks
-            ax.set_xticks([])
-            ax.set_yticks([])
-            continue
-
-        print(f"Processing file: {filepath} (Type: {plot_type})")
-        try:
-            # Load data, skipping the first row (header). unpack=True transposes the data.
-            data_raw = np.loadtxt(filepath, skiprows=1, unpack=True) 
-
-            ax.set_title(title, fontsize=14)
-            ax.set_xlabel(f"DFT {ylabel_base}", fontsize=12)
-            ax.set_ylabel(f"Predicted {ylabel_base}", fontsize=12)
-            ax.grid(True, linestyle='--', alpha=0.7)
-
-            min_val = np.inf
-            max_val = -np.inf
+        # Flatten axes array for easy iteration if it's 2D
+        axes = axes.flatten()
+
+        # Define component names for force (f) and virial (v) legends
+        component_names_f = ["fx", "fy", "fz"]
+        component_names_v = ["xx", "xy", "xz", "yx", "yy", "yz", "zx", "zy", "zz"]
+
+        for i, config in enumerate(output_files_config):
+            filepath = config['filepath']
+            title = config['title']
+            ylabel_full = config['ylabel'] # Full Y-axis label, e.g., "Energy (eV)"
+            plot_type = config['type']
+
+            # Extract base name from full Y-axis label for X/Y axis titles
+            ylabel_base = ylabel_full.split('(')[0].strip()
+
+            ax = axes[i] # Get the current subplot axis
+
+            if not os.path.exists(filepath):
+                print(f"Warning: File not found: {filepath}. Skipping this plot.")
+                ax.set_title(f"{title} (File not found)", color='red')
+                # Clear axis if skipped, to prevent empty plot with default ticks
+                ax.set_xticks([])
+                ax.set_yticks([])
+                continue
+
+            print(f"Processing file: {filepath} (Type: {plot_type})")
+            try:
+                # Use the cached array, or collect the data parsed by the worker (parsing errors are re-raised here)
+                data_raw = futures[filepath].result() if filepath in futures else cached[filepath]
+
+                ax.set_title(title, fontsize=14)
+                ax.set_xlabel(f"DFT {ylabel_base}", fontsize=12)
+                ax.set_ylabel(f"Predicted {ylabel_base}", fontsize=12)
+                ax.grid(True, linestyle='--', alpha=0.7)
+
+                # DFT and predicted columns share one axis range, so one reduction over all columns sets the limits
+                min_val = float(data_raw.min())
+                max_val = float(data_raw.max())
             
-            # Plot scatter based on file type
-            if plot_type == 'e': # Energy files (test.e.out, test.e_peratom.out)
-                # Data format: # dptest: data_e pred_e
-                dft_vals = data_raw[0]
-                pred_vals = data_raw[1]
-                ax.scatter(dft_vals, pred_vals, s=5, alpha=0.7, label='Data points')
-                
-                min_val = min(dft_vals.min(), pred_vals.min())
-                max_val = max(dft_vals.max(), pred_vals.max())
+                # Plot scatter based on file type
+                if plot_type == 'e': # Energy files (test.e.out, test.e_peratom.out)
+                    # Data format: # dptest: data_e pred_e
+                    dft_vals = data_raw[0]
+                    pred_vals = data_raw[1]
+                    ax.scatter(dft_vals, pred_vals, s=5, alpha=0.7, label='Data points', rasterized=True)
                 
-                # Add y=x reference line
-                ax.plot([min_val, max_val], [min_val, max_val], 'k--', alpha=0.6, label='y=x')
-                ax.set_aspect('equal', adjustable='box') # Ensure square aspect ratio
-                ax.legend(fontsize=10)
-
-            elif plot_type == 'f': # Force file (test.f.out)
-                # Data format: # dptest: data_fx data_fy data_fz pred_fx pred_fy pred_fz (6 columns)
-                # data_raw[0]=data_fx, data_raw[1]=data_fy, data_raw[2]=data_fz
-                # data_raw[3]=pred_fx, data_raw[4]=pred_fy, data_raw[5]=pred_fz
+                    # Add y=x reference line
+                    ax.plot([min_val, max_val], [min_val, max_val], 'k--', alpha=0.6, label='y=x')
+                    ax.set_aspect('equal', adjustable='box') # Ensure square aspect ratio
+                    ax.legend(fontsize=10)
+
+                elif plot_type == 'f': # Force file (test.f.out)
+                    # Data format: # dptest: data_fx data_fy data_fz pred_fx pred_fy pred_fz (6 columns)
+                    # data_raw[0]=data_fx, data_raw[1]=data_fy, data_raw[2]=data_fz
+                    # data_raw[3]=pred_fx, data_raw[4]=pred_fy, data_raw[5]=pred_fz
                 
-                # Plot scatter for each component
-                for j in range(3): # For fx, fy, fz
-                    dft_vals = data_raw[j]
-                    pred_vals = data_raw[j+3]
-                    ax.scatter(dft_vals, pred_vals, s=5, alpha=0.6, label=f'{component_names_f[j]}')
-                    
-                    # Update min/max for all components to set consistent axis limits
-                    min_val = min(min_val, dft_vals.min(), pred_vals.min())
-                    max_val = max(max_val, dft_vals.max(), pred_vals.max())
+                    # Plot scatter for each component (fx, fy, fz), or their density for large test sets
+                    plot_components(ax, data_raw[:3], data_raw[3:6], component_names_f, min_val, max_val, alpha=0.6)
                 
-                # Add y=x reference line
-                ax.plot([min_val, max_val], [min_val, max_val], 'k--', alpha=0.6, label='y=x')
-                ax.set_aspect('equal', adjustable='box')
-                ax.legend(fontsize=10, loc='best', ncol=3) # Force component legend in 3 columns
-
-            elif plot_type == 'v': # Virial files (test.v.out, test.v_peratom.out)
-                # Data format: # dptest: data_vxx ... data_vzz pred_vxx ... pred_vzz (18 columns)
-                # data_raw[0..8] are data_v components, data_raw[9..17] are pred_v components
+                    # Add y=x reference line
+                    ax.plot([min_val, max_val], [min_val, max_val], 'k--', alpha=0.6, label='y=x')
+                    ax.set_aspect('equal', adjustable='box')
+                    ax.legend(fontsize=10, loc='best', ncol=3) # Force component legend in 3 columns
+
+                elif plot_type == 'v': # Virial files (test.v.out, test.v_peratom.out)
+                    # Data format: # dptest: data_vxx ... data_vzz pred_vxx ... pred_vzz (18 columns)
+                    # data_raw[0..8] are data_v components, data_raw[9..17] are pred_v components
                 
-                # Plot scatter for each tensor component
-                for j in range(9): # For 9 tensor components
-                    dft_vals = data_raw[j]
-                    pred_vals = data_raw[j+9]
-                    ax.scatter(dft_vals, pred_vals, s=5, alpha=0.5, label=f'{component_names_v[j]}')
-                    
-                    min_val = min(min_val, dft_vals.min(), pred_vals.min())
-                    max_val = max(max_val, dft_vals.max(), pred_vals.max())
+                    # Plot scatter for each of the 9 tensor components, or their density for large test sets
+                    plot_components(ax, data_raw[:9], data_raw[9:18], component_names_v, min_val, max_val, alpha=0.5)
                 
-                # Add y=x reference line
-                ax.plot([min_val, max_val], [min_val, max_val], 'k--', alpha=0.6, label='y=x')
-                ax.set_aspect('equal', adjustable='box')
-                ax.legend(fontsize=8, loc='best', ncol=3) # Virial component legend in 3 columns
-
-            # Set consistent axis limits and add a small buffer
-            buffer = (max_val - min_val) * 0.05
-            ax.set_xlim(min_val - buffer, max_val + buffer)
-            ax.set_ylim(min_val - buffer, max_val + buffer)
-
-
-        except Exception as e:
-            print(f"Error processing {filepath}: {e}")
-            print(f"Please check the content and format of {filepath}. It should contain correct numerical data. Error: {e}")
-            # Clear axis if error occurs
-            ax.set_title(f"{title} (Error)", color='red')
-            ax.set_xticks([])
-            ax.set_yticks([])
-            continue
+                    # Add y=x reference line
+                    ax.plot([min_val, max_val], [min_val, max_val], 'k--', alpha=0.6, label='y=x')
+                    ax.set_aspect('equal', adjustable='box')
+                    ax.legend(fontsize=8, loc='best', ncol=3) # Virial component legend in 3 columns
+
+                # Set consistent axis limits and add a small buffer
+                buffer = (max_val - min_val) * 0.05
+                ax.set_xlim(min_val - buffer, max_val + buffer)
+                ax.set_ylim(min_val - buffer, max_val + buffer)
+
+
+            except Exception as e:
+                print(f"Error processing {filepath}: {e}")
+                print(f"Please check the content and format of {filepath}. It should contain correct numerical data. Error: {e}")
+                # Clear axis if error occurs
+                ax.set_title(f"{title} (Error)", color='red')
+                ax.set_xticks([])
+                ax.set_yticks([])
+                continue
     
-    # Remove any unused subplots
-    for j in range(i + 1, len(axes)):
-        fig.delaxes(axes[j])
+        # Remove any unused subplots
+        for j in range(i + 1, len(axes)):
+            fig.delaxes(axes[j])
 
     plt.tight_layout() # Adjust layout to prevent overlapping titles/labels
     plt.savefig(save_path, dpi=300)
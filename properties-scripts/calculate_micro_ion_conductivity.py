@@ -1,4 +1,4 @@
-# 这个脚本用于最终计算离子电导率，微观角度进行计算，最终数值基本一致与宏观载流子电导率计算  
+# 这个脚本用于最终计算离子电导率，微观角度进行计算，最终数值基本一致与宏观载流子电导率计算
 # 计算离子电导率
 # 需要的参数：count, slope, dim_fac, cell_volume, temperature
 # count: Li离子数目
@@ -9,16 +9,28 @@
 # 计算离子电导率
 # 公式：dd = slope / (2 * dim_fac) * 1e-4 * conversion_cm
 # conversion_cm: 转换因子，将结果从A^2/ps转换为mS/cm
-# 公式：dd = slope / (2 * dim_fac) * 1e-4 * conversion_cm
 # conversion_cm = 1000 * count / (cell_volume * 1e-24 * const.N_A) * (const.N_A * const.e)**2 / (const.R * temperature)
 #得到dd= mS/cm
-import ase.constants as const
-from scipy.stats import linregress
-import ase.traj
-# 计算离子电导率
+# 所有参数既可以是标量也可以是numpy数组（按广播规则计算），可以一次算完一组温度/斜率的Arrhenius数据
+import numpy as np
+from scipy import constants as const
+
+
+def micro_ion_conductivity(count, slope, cell_volume, temperature, dim_fac=3):
+    """
+    由MSD斜率计算离子电导率（Nernst-Einstein），返回值单位为mS/cm
+    count: 离子数目; slope: MSD斜率 (A^2/ps); cell_volume: 体积 (A^3); temperature: 温度 (K); dim_fac: 维度因子
+    """
+    count = np.asarray(count, dtype=float)
+    # 载流子浓度 (mol/cm^3) * F^2 / (RT)，再乘1000由S/cm换成mS/cm
     conversion_cm = 1000 * count / \
-        (cell_volume * 1e-24 * const.N_A) * \
-        (const.N_A * const.e)**2 / (const.R * temperature)
-dd=slope / (2*MSD.dim_fac) * 1e-4*conversion_cm
+        (np.asarray(cell_volume, dtype=float) * 1e-24 * const.N_A) * \
+        (const.N_A * const.e)**2 / (const.R * np.asarray(temperature, dtype=float))
+    # 扩散系数 D = slope / (2 * dim_fac)，1e-4 将 A^2/ps 换成 cm^2/s
+    return np.asarray(slope, dtype=float) / (2 * dim_fac) * 1e-4 * conversion_cm
+
 
-#ount=96, slope这里是0.02，dim_fac=3，体积是8852A3，温度400K，计算dd,dd=16.8mS/cm
+if __name__ == "__main__":
+    #count=96, slope这里是0.02，dim_fac=3，体积是8852A3，温度400K，计算dd,dd=16.8mS/cm
+    dd = micro_ion_conductivity(count=96, slope=0.02, cell_volume=8852, temperature=400, dim_fac=3)
+    print(f"dd = {dd:.2f} mS/cm")
@@ -1,10 +1,11 @@
-import dpdata
+from ase.io import read, write
   
 # -----------------------------------
 # 示例 1: 转换单个结构（如 POSCAR）
 # -----------------------------------
-# 读取 POSCAR
-system = dpdata.System("POSCAR", fmt="vasp/poscar")
+# 读取 POSCAR（ASE 直接读写，不需要导入 dpdata）
+atoms = read("POSCAR", format="vasp")
 
-# 保存为 XYZ
-system.to("xyz", "output.xyz")
+# 保存为 XYZ（普通 xyz：元素 + 坐标四列，check_nd.py 的 DebyeCalculator 直接读取；
+# extxyz 会为 Selective dynamics 多写一列 move_mask，会被当成占有率）
+write("output.xyz", atoms, format="xyz")
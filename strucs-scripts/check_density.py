@@ -1,10 +1,16 @@
 import sys
+import numpy as np
 from ase.io import read
 from ase import units
+from ase.data import atomic_masses
 
 def calculate_density(atoms):
     cell_volume = atoms.get_volume() * 1e-24 # 从 Å^3 转换为 cm^3
-    mass = atoms.get_masses().sum() * units._amu # 将原子质量单位转换为kg（ASE中的amu是以kg为单位的）
+    if 'masses' in atoms.arrays: # 结构文件自带原子质量时沿用
+        total_amu = atoms.arrays['masses'].sum()
+    else: # 按元素计数乘以元素质量表求和，不为每个原子生成质量数组
+        total_amu = np.bincount(atoms.numbers) @ atomic_masses[:atoms.numbers.max() + 1]
+    mass = total_amu * units._amu # 将原子质量单位转换为kg（ASE中的amu是以kg为单位的）
     density = mass / cell_volume # 密度单位是 kg/cm^3
     density *= 1e3  # 将密度从 kg/cm^3 转换为 g/cm^3
     return density
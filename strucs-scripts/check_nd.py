@@ -1,23 +1,27 @@
 from debyecalculator import DebyeCalculator
+import sys
 import torch
 import matplotlib.pyplot as plt
 
 
-# Initialize the DebyeCalculator object
-calc = DebyeCalculator(qmin=1.0, qmax=20.0, qstep=0.05, qdamp=0.0,biso=0.0,device='cpu')
+# Initialize the DebyeCalculator object once (Q grid built once, on the GPU when there is one)
+device = 'cuda' if torch.cuda.is_available() else 'cpu'
+calc = DebyeCalculator(qmin=1.0, qmax=20.0, qstep=0.05, qdamp=0.0,biso=0.0,device=device)
 
 
-# Define structure sources
-xyz_file = "output.xyz"
-q, iq= calc.iq(xyz_file)
+# Define structure sources: xyz files from the command line, default output.xyz
+xyz_files = sys.argv[1:] or ["output.xyz"]
+results = calc.iq(xyz_files)
+if len(xyz_files) == 1: # iq returns a bare (q, iq) tuple for a single structure
+    results = [results]
 
-å
 
 # Plot
 fig, ax = plt.subplots(figsize=(6,3))
-ax.plot(q, iq, label=f"Simulated XRD for {xyz_file.split('/')[-1]}")
+for xyz_file, (q, iq) in zip(xyz_files, results):
+    ax.plot(q, iq, label=f"Simulated XRD for {xyz_file.split('/')[-1]}")
 ax.set(xlabel='Q [$Å^{-1}$]', ylabel='I(Q) [a.u.]', yticks=[])
 ax.grid(alpha=0.2)
 ax.legend()
-plt.show()
 plt.savefig("IQ.png")
+plt.show()